@@ -1,88 +1,1281 @@
-from flask import Flask, render_template_string, request, send_file, send_from_directory
-from io import BytesIO
+from flask import Flask, Response, jsonify, render_template_string, request, send_file, send_from_directory, url_for
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bisect
+import codecs
+import contextlib
+import contextvars
+import functools
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import secrets
+import shutil
+import socket
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
 import zipfile
-import random
-
-def parse_questions(text):
-    lines = [l.strip() for l in text.strip().split('\n') if l.strip()]
-    questions = []
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith('Q'):
-            q_text = lines[i]
-            choices = []
-            i += 1
-            while i < len(lines) and len(choices) < 4:
-                if lines[i] and lines[i][0] in 'ABCD' and ')' in lines[i]:
-                    choices.append(lines[i])
-                    i += 1
-                else:
-                    break
-            if len(choices) == 4:
-                questions.append({'question': q_text, 'choices': choices})
+import zlib
+import numpy as np
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+class Trace:
+    # Wall time per stage of one request, plus sizes such as bank questions
+    # and output bytes. Stages are exclusive: entering a nested stage pauses
+    # the outer one, so the parts add up to the time spent in stages.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.sizes = {}
+        self.error = None
+        self.active = None
+        self.since = self.started
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        outer = self.active
+        self._switch(name)
+        try:
+            yield
+        finally:
+            self._switch(outer)
+
+    def _switch(self, name):
+        now = time.perf_counter()
+        if self.active is not None:
+            self.stages[self.active] = self.stages.get(self.active, 0.0) + now - self.since
+        self.active, self.since = name, now
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        return ', '.join(parts + [f'total;dur={self.elapsed() * 1000:.1f}'])
+
+# The trace of the request or job running in this context, if any. Worker
+# processes have none, so the helpers below cost next to nothing there.
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def timed(name):
+    trace = current_trace.get()
+    return trace.stage(name) if trace is not None else contextlib.nullcontext()
+
+def record(name, value):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.sizes[name] = value
+
+def tally(name, amount):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.sizes[name] = trace.sizes.get(name, 0) + amount
+
+class InputError(ValueError):
+    pass
+
+class QuestionBank:
+    # Parsed once per upload: stems without the "Q1:" prefix, an (n, 4)
+    # array of choice texts without "A)" labels, the correct choice index
+    # and a topic index into topic_names ('' for untagged) per question.
+    # Versions only ever index into these arrays.
+    __slots__ = ('stems', 'choices', 'correct', 'topics', 'topic_names', 'strata', 'digest')
+
+    def __init__(self, stems, choices, correct=None, topics=None, topic_names=None):
+        self.stems = stems
+        self.choices = choices
+        self.correct = correct
+        self.topics = topics if topics is not None else np.zeros(len(stems), dtype=np.uint16)
+        self.topic_names = topic_names if topic_names is not None else ['']
+        self.strata = None
+        self.digest = None
+
+    def __len__(self):
+        return len(self.stems)
+
+    def take(self, rows):
+        return self.stems[rows], self.choices[rows]
+
+    def content_hash(self):
+        # Identifies what the bank contains rather than the bytes it was
+        # uploaded as; runs are seeded with it, so the same questions give
+        # the same versions however the bank was loaded.
+        if self.digest is None:
+            digest = hashlib.sha256()
+            for stem, choices in zip(self.stems.tolist(), self.choices.tolist()):
+                digest.update('\x1f'.join((stem, *choices)).encode('utf-8') + b'\x1e')
+            digest.update(np.asarray(self.correct, dtype=np.uint8).tobytes())
+            digest.update(np.asarray(self.topics, dtype='<u2').tobytes())
+            digest.update(json.dumps(self.topic_names).encode('utf-8'))
+            self.digest = digest.hexdigest()
+        return self.digest
+
+    def topic_rows(self):
+        # Row indices grouped by topic, built once and reused by every run
+        # that samples from this bank.
+        if self.strata is None:
+            order = np.argsort(self.topics, kind='stable')
+            counts = np.bincount(self.topics, minlength=len(self.topic_names))
+            self.strata = np.split(order, np.cumsum(counts)[:-1])
+        return self.strata
+
+READ_CHUNK = 64 * 1024
+
+def iter_lines(source):
+    # Yields (line number, stripped line) for non-blank lines. Binary streams
+    # are decoded incrementally, so an upload is never held whole in memory.
+    if isinstance(source, str):
+        lines = io.StringIO(source)
+    else:
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        lines = _decode_lines(source)
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            yield lineno, line
+
+def _decode_lines(stream):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    while True:
+        with timed('decode'):
+            chunk = stream.read(READ_CHUNK)
+            lines = (tail + decoder.decode(chunk, final=not chunk)).split('\n')
+            tail = lines.pop()
+        yield from lines
+        if not chunk:
+            break
+    if tail:
+        yield tail
+
+TOPIC_TAG = re.compile(r'\[([^\]]+)\]')
+
+def iter_questions(source, rejected=None):
+    # Yields (stem, [4 choices], topic) as soon as a question's fourth
+    # choice is read. A topic is tagged in the prefix, as in
+    # "Q7 [Algebra]: ...". Lines that cannot be used are appended to
+    # `rejected` as (line number, reason) instead of being dropped silently.
+    reject = rejected.append if rejected is not None else lambda entry: None
+    start = stem = choices = topic = None
+    for lineno, line in iter_lines(source):
+        if choices is not None:
+            if line[0] in 'ABCD' and ')' in line:
+                choices.append(line.split(')', 1)[1].strip())
+                if len(choices) == 4:
+                    yield stem, choices, topic
+                    choices = None
+                continue
+            reject((start, f"question has only {len(choices)} of 4 choices"))
+            choices = None
+        if line.startswith('Q'):
+            start, stem, choices, topic = lineno, line, [], ''
+            if ':' in stem:
+                prefix, stem = stem.split(':', 1)
+                stem = stem.strip()
+                tag = TOPIC_TAG.search(prefix)
+                if tag:
+                    topic = tag.group(1).strip()
         else:
-            i += 1
-    return questions
+            reject((lineno, "not part of a question"))
+    if choices is not None:
+        reject((start, f"question has only {len(choices)} of 4 choices"))
+
+def parse_questions(source, rejected=None):
+    stems = []
+    choices = []
+    topics = []
+    topic_ids = {'': 0}
+    for stem, q_choices, topic in iter_questions(source, rejected):
+        stems.append(stem)
+        choices.append(q_choices)
+        topics.append(topic_ids.setdefault(topic, len(topic_ids)))
+    return QuestionBank(
+        np.array(stems, dtype=object),
+        np.array(choices, dtype=object).reshape(-1, 4),
+        topics=np.array(topics, dtype=np.uint16),
+        topic_names=list(topic_ids)
+    )
 
-def parse_answers(text):
-    lines = [l.strip() for l in text.strip().split('\n') if l.strip()]
-    answers = []
-    for line in lines:
+def iter_answers(source, rejected=None):
+    for lineno, line in iter_lines(source):
         for char in line.upper():
             if char in 'ABCD':
-                answers.append(char)
+                yield ord(char) - ord('A')
                 break
-    return answers
-
-def shuffle_exam(questions, answers):
-    paired = list(zip(questions, answers))
-    random.shuffle(paired)
-    new_questions = []
-    new_answers = []
-    for q, correct_letter in paired:
-        # Get the choice texts without letters
-        choice_texts = [c.split(')', 1)[1].strip() for c in q['choices']]
-        # Find which text is correct
-        correct_idx = ord(correct_letter) - ord('A')
-        correct_text = choice_texts[correct_idx]
-        # Shuffle the choice texts
-        random.shuffle(choice_texts)
-        # Find new position of correct answer
-        new_correct_idx = choice_texts.index(correct_text)
-        new_correct_letter = chr(ord('A') + new_correct_idx)
-        # Rebuild choices with A), B), C), D) labels
-        new_choices = [f"{chr(65+i)}) {text}" for i, text in enumerate(choice_texts)]
-        new_questions.append({'question': q['question'], 'choices': new_choices})
-        new_answers.append(new_correct_letter)
-    return new_questions, new_answers
-
-def generate_all(questions, answers, num_versions):
+        else:
+            if rejected is not None:
+                rejected.append((lineno, "no answer letter A-D"))
+
+def parse_answers(source, rejected=None):
+    return np.fromiter(iter_answers(source, rejected), dtype=np.int8)
+
+# Compiled bank layout: a 56-byte header (magic, version, count, offset of
+# the topic names, content hash), 5n+1 little-endian uint64 offsets into the blob (stem
+# and four choices per question), n uint16 topic indices, n uint8 correct
+# indices, the UTF-8 blob itself and finally the topic names as JSON.
+BANK_HEADER = struct.Struct('<4sHHQQ32s')
+BANK_MAGIC = b'EXQB'
+BANK_VERSION = 3
+BANKS_DIR = os.environ.get('EXAM_BANKS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'banks'))
+
+def _write_bank_to(bank, f):
+    texts = [s.encode('utf-8') for row in zip(bank.stems, *bank.choices.T) for s in row]
+    offsets = np.zeros(len(texts) + 1, dtype='<u8')
+    np.cumsum(np.fromiter(map(len, texts), dtype='<u8', count=len(texts)), out=offsets[1:])
+    names_at = BANK_HEADER.size + offsets.nbytes + 3 * len(bank) + int(offsets[-1])
+    f.write(BANK_HEADER.pack(
+        BANK_MAGIC, BANK_VERSION, 0, len(bank), names_at, bytes.fromhex(bank.content_hash())
+    ))
+    f.write(offsets.tobytes())
+    f.write(bank.topics.astype('<u2').tobytes())
+    f.write(bank.correct.astype(np.uint8).tobytes())
+    f.writelines(texts)
+    f.write(json.dumps(bank.topic_names).encode('utf-8'))
+
+# mkstemp creates files 0600; finished files are moved into place with the
+# mode open() would have given them. The umask is read once, at import,
+# since reading it means briefly setting it.
+_umask = os.umask(0o077)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+def write_bank(bank, path):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_bank_to(bank, f)
+        os.chmod(tmp, FILE_MODE)
+        os.replace(tmp, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+
+def pack_bank(bank):
+    f = io.BytesIO()
+    _write_bank_to(bank, f)
+    return f.getvalue()
+
+def _bank_layout(buffer, name):
+    # (offsets, topics, correct, blob start, topic names, digest) as views
+    # into a compiled bank's bytes, after checking its header.
+    magic, version, _, count, names_at, digest = BANK_HEADER.unpack_from(buffer)
+    if magic != BANK_MAGIC:
+        raise InputError(f"❌ {name} is not a compiled question bank")
+    if version != BANK_VERSION:
+        raise InputError(f"❌ {name} was compiled by another version; compile it again")
+    offsets = np.frombuffer(buffer, dtype='<u8', count=5 * count + 1, offset=BANK_HEADER.size)
+    topics_at = BANK_HEADER.size + offsets.nbytes
+    correct_at = topics_at + 2 * count
+    return (
+        offsets,
+        np.frombuffer(buffer, dtype='<u2', count=count, offset=topics_at),
+        np.frombuffer(buffer, dtype=np.uint8, count=count, offset=correct_at),
+        correct_at + count,
+        json.loads(bytes(buffer[names_at:]).decode('utf-8')),
+        digest.hex(),
+    )
+
+def unpack_bank(data):
+    # A fully decoded bank from pack_bank()'s bytes. Unlike unpickling,
+    # reading this format can only ever produce data.
+    offsets, topics, correct, blob, topic_names, digest = _bank_layout(data, 'cached bank')
+    edges = (offsets + blob).tolist()
+    view = memoryview(data)
+    texts = np.array([str(view[a:b], 'utf-8') for a, b in zip(edges, edges[1:])], dtype=object).reshape(-1, 5)
+    bank = QuestionBank(texts[:, 0].copy(), texts[:, 1:].copy(), correct.copy(), topics.copy(), topic_names)
+    bank.digest = digest
+    return bank
+
+class MappedBank(QuestionBank):
+    # A compiled bank opened with mmap. The offsets and answers are views
+    # into the mapping; question text is decoded the first time a version
+    # uses it, so opening a large bank reads only its header.
+    __slots__ = ('path', 'offsets', 'blob', 'mapping')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets, topics, correct, blob, topic_names, digest = _bank_layout(mapping, os.path.basename(path))
+        self.path = path
+        self.mapping = mapping
+        self.offsets = offsets
+        self.blob = blob
+        count = len(correct)
+        super().__init__(np.empty(count, dtype=object), np.empty((count, 4), dtype=object), correct, topics, topic_names)
+        self.digest = digest
+
+    def __reduce__(self):
+        return MappedBank, (self.path,)
+
+    def take(self, rows):
+        missing = rows[np.equal(self.stems[rows], None)]
+        for row in np.unique(missing).tolist():
+            edges = (self.offsets[5 * row:5 * row + 6] + self.blob).tolist()
+            texts = [str(self.mapping[a:b], 'utf-8') for a, b in zip(edges, edges[1:])]
+            self.stems[row] = texts[0]
+            self.choices[row] = texts[1:]
+        return super().take(rows)
+
+@functools.lru_cache(maxsize=16)
+def _open_mapped(path, mtime):
+    return MappedBank(path)
+
+def open_bank(ref):
+    # `ref` is a path to a .qbank file or the id of one stored in BANKS_DIR.
+    path = os.fspath(ref)
+    if not os.path.isfile(path):
+        if not re.fullmatch(r'[0-9a-f]{64}', path):
+            raise InputError(f"❌ Unknown question bank: {path}")
+        path = stored_bank_path(path)
+    try:
+        return _open_mapped(os.path.abspath(path), os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        raise InputError(f"❌ Unknown question bank: {ref}") from None
+
+# All 24 orderings of four choices; a shuffle is stored as a row index into
+# this table. CHOICE_SLOTS[p, c] is where original choice c lands under p.
+CHOICE_PERMS = np.array(list(itertools.permutations(range(4))), dtype=np.int8)
+CHOICE_SLOTS = np.argsort(CHOICE_PERMS, axis=1).astype(np.int8)
+
+def draw_permutations(num_versions, correct, rng=None):
+    # One batch for the whole run: a versions x questions question order, a
+    # versions x questions x 4 choice order and the matching answer keys.
+    rng = rng if rng is not None else np.random.default_rng()
+    num_questions = len(correct)
+    order = np.argsort(rng.random((num_versions, num_questions)), axis=1)
+    perm_ids = rng.integers(len(CHOICE_PERMS), size=(num_versions, num_questions))
+    keys = CHOICE_SLOTS[perm_ids, correct[order]]
+    return order, CHOICE_PERMS[perm_ids], keys
+
+def shuffle_exam(bank, rng=None):
+    order, choice_order, keys = draw_permutations(1, bank.correct, rng)
+    order, choice_order = order[0], choice_order[0]
+    stems, choices = bank.take(order)
+    return QuestionBank(stems, np.take_along_axis(choices, choice_order, axis=1), keys[0])
+
+@functools.lru_cache(maxsize=8)
+def number_labels(count):
+    labels = np.array([f"{i}. " for i in range(1, count + 1)], dtype=object)
+    labels.flags.writeable = False
+    return labels
+
+KEY_LINES = np.array(['A\n', 'B\n', 'C\n', 'D\n'], dtype=object)
+
+def render_version(bank, order, choice_order, keys, version):
+    # Each question is laid out as one row of string pieces and gathered by
+    # fancy indexing, so building a version is a single join.
+    labels = number_labels(len(order))
+    stems, choices = bank.take(order)
+    exam = np.empty((len(order), 11), dtype=object)
+    exam[:, 0] = labels
+    exam[:, 1] = stems
+    exam[:, 2:9:2] = ["\n   A) ", "\n   B) ", "\n   C) ", "\n   D) "]
+    exam[:, 3::2] = np.take_along_axis(choices, choice_order, axis=1)
+    exam[:, 10] = "\n\n"
+    answer = np.empty((len(order), 2), dtype=object)
+    answer[:, 0] = labels
+    answer[:, 1] = KEY_LINES[keys]
+    return {
+        f'exam_version_{version}.txt': f"EXAM VERSION {version}\n{'='*50}\n\n" + ''.join(exam.ravel().tolist()),
+        f'answers_version_{version}.txt': f"ANSWER KEY - VERSION {version}\n{'='*50}\n\n" + ''.join(answer.ravel().tolist()),
+    }
+
+def version_label(index):
+    # A..Z, then AA, AB, ... like spreadsheet columns.
+    label = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        label = chr(65 + rem) + label
+    return label
+
+def version_rng(entropy, index):
+    # Each version has its own seed stream derived from the run entropy and
+    # its index, so the result never depends on which process rendered it.
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(index,)))
+
+def new_seed():
+    return secrets.randbits(32)
+
+def run_entropy(bank, seed):
+    # A run is addressed by (bank content, seed); version i then draws from
+    # spawn key (i,) and its sample from (i, 1), so any single version can
+    # be rebuilt later without generating the others. Checked here, before
+    # any version is drawn, since SeedSequence only takes non-negative ints.
+    if not isinstance(seed, (int, np.integer)) or seed < 0:
+        raise InputError(f"❌ Seed must be a non-negative whole number, not {seed!r}")
+    return (int(seed), int(bank.content_hash(), 16))
+
+def label_index(label):
+    # Inverse of version_label(); None for anything that is not a label.
+    if not re.fullmatch(r'[A-Z]{1,4}', label):
+        return None
+    index = 0
+    for char in label:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+def render_seeded(bank, index, entropy, rows=None):
+    # `rows` restricts the version to a sample of the bank.
+    correct = bank.correct if rows is None else bank.correct[rows]
+    with timed('shuffle'):
+        order, choice_order, keys = draw_permutations(1, correct, version_rng(entropy, index))
+        order = order[0] if rows is None else rows[order[0]]
+    with timed('render'):
+        return render_version(bank, order, choice_order[0], keys[0], version_label(index))
+
+# How each version samples from a bank larger than one exam. `stratify` is
+# False, True (topics in proportion to the bank) or {topic: count}; `common`
+# questions appear in every version; `distinct` keeps consecutive versions
+# from sharing anything else.
+Sampling = namedtuple('Sampling', 'size stratify common distinct', defaults=(False, 0, False))
+
+def allocate(total, weights):
+    # Largest-remainder split of `total` in proportion to `weights`.
+    weights = np.asarray(weights, dtype=float)
+    exact = total * weights / weights.sum()
+    counts = np.floor(exact).astype(int)
+    counts[np.argsort(counts - exact, kind='stable')[:total - counts.sum()]] += 1
+    return counts
+
+def pick(rng, pool, count, exclude=frozenset()):
+    # `count` distinct members of the index array `pool`, none in `exclude`.
+    # Rejection sampling costs O(count) while the pool is mostly free; once
+    # it is dense an O(len(pool)) shuffle is no worse.
+    if 2 * (count + len(exclude)) > len(pool):
+        allowed = pool[~np.isin(pool, list(exclude))] if exclude else pool
+        return rng.permutation(allowed)[:count]
+    chosen = {}
+    while len(chosen) < count:
+        for row in pool[rng.integers(len(pool), size=2 * (count - len(chosen)))].tolist():
+            if row not in exclude and row not in chosen:
+                chosen[row] = None
+                if len(chosen) == count:
+                    break
+    return np.fromiter(chosen, dtype=np.intp, count=count)
+
+def sample_rng(entropy, index):
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(index, 1)))
+
+def sample_versions(bank, num_versions, sampling, entropy, first=0):
+    # Validates the request up front, then returns a generator of the rows
+    # each version uses. Only the per-topic index is O(bank size); every
+    # version after that costs O(size).
+    size, stratify, common, distinct = sampling
+    if isinstance(stratify, dict):
+        topic_ids = {name: i for i, name in enumerate(bank.topic_names)}
+        unknown = [name for name in stratify if name not in topic_ids]
+        if unknown:
+            raise InputError(f"❌ Unknown topic: {', '.join(unknown)}")
+        groups = [bank.topic_rows()[topic_ids[name]] for name in stratify]
+        quotas = np.array(list(stratify.values()), dtype=int)
+        size = int(quotas.sum())
+    elif stratify:
+        groups = [rows for rows in bank.topic_rows() if len(rows)]
+        quotas = allocate(size, [len(rows) for rows in groups])
+    else:
+        groups = [np.arange(len(bank))]
+        quotas = np.array([size])
+    if not 1 <= size <= len(bank):
+        raise InputError(f"❌ Questions per version must be between 1 and {len(bank)}")
+    if not 0 <= common <= size:
+        raise InputError(f"❌ Common questions must be between 0 and {size}")
+    shared = allocate(common, quotas) if common else np.zeros(len(groups), dtype=int)
+    for rows, quota, anchors in zip(groups, quotas, shared):
+        needed = quota + (quota - anchors if distinct else 0)
+        if not 0 <= needed <= len(rows):
+            raise InputError(f"❌ The bank is too small to sample {size} questions per version this way")
+    anchor_rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(0, 2)))
+    anchors = [pick(anchor_rng, rows, count) for rows, count in zip(groups, shared)]
+    return _iter_samples(groups, quotas, anchors, num_versions, entropy, distinct, first)
+
+def _iter_samples(groups, quotas, anchors, num_versions, entropy, distinct, first):
+    # Versions from `first` on. With `distinct` each sample depends on the
+    # one before it, so earlier versions are replayed without being yielded.
+    pinned = [set(a.tolist()) for a in anchors]
+    previous = [frozenset()] * len(groups)
+    for i in range(0 if distinct else first, num_versions):
+        with timed('sample'):
+            rng = sample_rng(entropy, i)
+            parts = []
+            for g, (rows, quota, fixed) in enumerate(zip(groups, quotas, anchors)):
+                fresh = pick(rng, rows, quota - len(fixed), pinned[g] | previous[g])
+                if distinct:
+                    previous[g] = frozenset(fresh.tolist())
+                parts += (fixed, fresh)
+        if i >= first:
+            yield np.concatenate(parts)
+
+MAX_VERSIONS = int(os.environ.get('EXAM_MAX_VERSIONS', 1000))
+WORKERS = int(os.environ.get('EXAM_WORKERS', os.cpu_count() or 1))
+# Below this many rendered questions a process pool costs more than it saves.
+PARALLEL_MIN_WORK = 200_000
+
+# One render pool per process, started on first use from a clean forkserver
+# (or spawn) parent rather than by forking this multithreaded one. At most
+# POOL_RUNS runs use it at once; any other large run renders in-process.
+POOL_RUNS = int(os.environ.get('EXAM_POOL_RUNS', 2))
+POOL_DIR = os.path.join(tempfile.gettempdir(), 'exam-render')
+_pool = None
+_pool_lock = threading.Lock()
+_pool_runs = threading.BoundedSemaphore(POOL_RUNS)
+
+def render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(WORKERS, mp_context=context)
+        return _pool
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def pool_bank_path(bank):
+    # Workers open banks by path, so they share one read-only mapping
+    # instead of a pickled copy each. An uploaded bank is compiled into
+    # POOL_DIR under its content hash; copies idle for a day are removed.
+    if isinstance(bank, MappedBank):
+        return bank.path
+    os.makedirs(POOL_DIR, mode=0o700, exist_ok=True)
+    path = os.path.join(POOL_DIR, f'{bank.content_hash()}.qbank')
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        write_bank(bank, path)
+        now = time.time()
+        with os.scandir(POOL_DIR) as it:
+            for entry in it:
+                with contextlib.suppress(FileNotFoundError):
+                    if now - entry.stat().st_mtime > 86400:
+                        os.unlink(entry.path)
+    return path
+
+def _render_in_worker(path, index, entropy, rows):
+    return render_seeded(open_bank(path), index, entropy, rows)
+
+def iter_versions(bank, num_versions, seed=None, workers=None, sampling=None):
+    # Not a generator itself, so bad banks or sampling settings raise here,
+    # before a response has started streaming.
+    if isinstance(bank, (str, os.PathLike)):
+        bank = open_bank(bank)
+    entropy = run_entropy(bank, seed if seed is not None else new_seed())
+    if sampling is not None:
+        samples = sample_versions(bank, num_versions, sampling, entropy)
+        per_version = sampling.size or len(bank)
+    else:
+        samples = itertools.repeat(None)
+        per_version = len(bank)
+    record('questions', len(bank))
+    record('versions', num_versions)
+    return _render_versions(bank, num_versions, entropy, samples, per_version, workers)
+
+def _render_versions(bank, num_versions, entropy, samples, per_version, workers):
+    workers = min(workers or WORKERS, WORKERS, num_versions)
+    if workers <= 1 or per_version * num_versions < PARALLEL_MIN_WORK or not _pool_runs.acquire(blocking=False):
+        for i, rows in zip(range(num_versions), samples):
+            yield render_seeded(bank, i, entropy, rows)
+        return
+    # Only a bounded window of versions is in flight, so a slow client never
+    # buffers the whole run and other runs get their turn in the pool.
+    pending = deque()
+    try:
+        path = pool_bank_path(bank)
+        pool = render_pool()
+        try:
+            for i, rows in zip(range(num_versions), samples):
+                pending.append(pool.submit(_render_in_worker, path, i, entropy, rows))
+                if len(pending) >= 2 * workers:
+                    with timed('render'):
+                        files = pending.popleft().result()
+                    yield files
+            while pending:
+                with timed('render'):
+                    files = pending.popleft().result()
+                yield files
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+    finally:
+        for future in pending:
+            future.cancel()
+        _pool_runs.release()
+
+def render_single(bank, seed, index, sampling=None):
+    # One version of a run, in O(questions) and without touching the others
+    # (a `distinct` sample replays the samples before it, so the index is
+    # bounded like a run's version count).
+    if not 0 <= index < MAX_VERSIONS:
+        raise InputError(f"❌ Version index must be between 0 and {MAX_VERSIONS - 1}")
+    if isinstance(bank, (str, os.PathLike)):
+        bank = open_bank(bank)
+    entropy = run_entropy(bank, seed)
+    record('questions', len(bank))
+    record('versions', 1)
+    rows = None
+    if sampling is not None:
+        rows = next(sample_versions(bank, index + 1, sampling, entropy, first=index))
+    return render_seeded(bank, index, entropy, rows)
+
+def generate_all(bank, num_versions, seed=None, workers=None, sampling=None):
     files = {}
-    for i in range(num_versions):
-        version = chr(65 + i)
-        shuffled_q, shuffled_a = shuffle_exam(questions, answers)
-        exam_text = f"EXAM VERSION {version}\n{'='*50}\n\n"
-        for idx, q in enumerate(shuffled_q, 1):
-            q_text = q['question']
-            if ':' in q_text:
-                q_text = q_text.split(':', 1)[1].strip()
-            exam_text += f"{idx}. {q_text}\n"
-            for choice in q['choices']:
-                exam_text += f"   {choice}\n"
-            exam_text += "\n"
-        files[f'exam_version_{version}.txt'] = exam_text
-        answer_text = f"ANSWER KEY - VERSION {version}\n{'='*50}\n\n"
-        for idx, ans in enumerate(shuffled_a, 1):
-            answer_text += f"{idx}. {ans}\n"
-        files[f'answers_version_{version}.txt'] = answer_text
+    for version_files in iter_versions(bank, num_versions, seed, workers, sampling):
+        files.update(version_files)
     return files
 
+# Archives are written by hand rather than with zipfile/tarfile so entries
+# can be compressed ahead of the writer, in threads (zlib releases the GIL),
+# and so every entry carries the same timestamp: the bytes of an archive
+# depend only on the run, its format and its compression level.
+ARCHIVE_LEVEL = int(os.environ.get('EXAM_ARCHIVE_LEVEL', 6))
+ARCHIVE_THREADS = int(os.environ.get('EXAM_ARCHIVE_THREADS', os.cpu_count() or 1))
+ARCHIVE_MTIME = 315532800  # 1980-01-01, the earliest time a ZIP can record
+archive_executor = ThreadPoolExecutor(ARCHIVE_THREADS, thread_name_prefix='deflate')
+
+# `format` is "zip" or "tar.gz"; level 0 stores entries uncompressed (a
+# plain .tar for "tar.gz").
+Archive = namedtuple('Archive', 'format level', defaults=('zip', ARCHIVE_LEVEL))
+
+def archive_type(archive):
+    # (download name, mimetype)
+    if archive.format == 'zip':
+        return 'exam_papers.zip', 'application/zip'
+    if archive.level:
+        return 'exam_papers.tar.gz', 'application/gzip'
+    return 'exam_papers.tar', 'application/x-tar'
+
+def gzip_bytes(data, level):
+    # One complete gzip member; zlib leaves its mtime at zero.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def _deflate_entry(data, level):
+    crc = zlib.crc32(data)
+    if level:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    return crc, data
+
+def _tar_entry(name, data, level):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = ARCHIVE_MTIME
+    info.mode = 0o644
+    block = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape') + data + bytes(-len(data) % tarfile.BLOCKSIZE)
+    return gzip_bytes(block, level) if level else block
+
+def _compressed_entries(versions, compress, stage):
+    # Yields, once per version, the (name, size, compressed) entries that are
+    # ready, in archive order, then whatever is left. At most a small window
+    # of entries is in flight, so memory stays around one version.
+    pending = deque()
+    window = 2 * ARCHIVE_THREADS
+    try:
+        for files in versions:
+            ready = []
+            with timed(stage):
+                for name, content in files.items():
+                    data = content.encode('utf-8')
+                    tally('output_bytes', len(data))
+                    if ARCHIVE_THREADS > 1:
+                        pending.append((name, len(data), archive_executor.submit(compress, name, data)))
+                    else:
+                        ready.append((name, len(data), compress(name, data)))
+                while len(pending) > window:
+                    name, size, future = pending.popleft()
+                    ready.append((name, size, future.result()))
+            yield ready
+        with timed(stage):
+            ready = [(name, size, future.result()) for name, size, future in pending]
+            pending.clear()
+        yield ready
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+class ZipWriter:
+    # Streaming ZIP writer for entries whose CRC and compressed bytes are
+    # known up front, so no data descriptors are needed. ZIP64 records are
+    # only added when an entry or offset outgrows 32 bits.
+    LOCAL = struct.Struct('<IHHHHHIIIHH')
+    CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+    END = struct.Struct('<IHHHHIIH')
+    END64 = struct.Struct('<IQHHIIQQQQ')
+    LOCATOR64 = struct.Struct('<IIQI')
+    DOS_DATE = (0 << 9) | (1 << 5) | 1  # ARCHIVE_MTIME
+    LIMIT = 0xFFFFFFFF
+
+    def __init__(self):
+        self.offset = 0
+        self.central = []
+
+    def add(self, name, size, crc, data, method):
+        name = name.encode('utf-8')
+        large = size >= self.LIMIT or len(data) >= self.LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, size, len(data)) if large else b''
+        sizes = (self.LIMIT, self.LIMIT) if large else (len(data), size)
+        version = 45 if large or self.offset >= self.LIMIT else 20
+        header = self.LOCAL.pack(0x04034b50, version, 0, method, 0, self.DOS_DATE, crc, *sizes, len(name), len(extra))
+        self.central.append((name, size, len(data), crc, method, version, self.offset))
+        self.offset += len(header) + len(name) + len(extra) + len(data)
+        return header + name + extra + data
+
+    def finish(self):
+        parts = []
+        for name, size, csize, crc, method, version, offset in self.central:
+            fields = [size, csize, offset]
+            wide = [value for value in fields if value >= self.LIMIT]
+            extra = struct.pack(f'<HH{len(wide)}Q', 1, 8 * len(wide), *wide) if wide else b''
+            fields = [self.LIMIT if value >= self.LIMIT else value for value in fields]
+            parts.append(self.CENTRAL.pack(
+                0x02014b50, (3 << 8) | version, version, 0, method, 0, self.DOS_DATE, crc,
+                fields[1], fields[0], len(name), len(extra), 0, 0, 0, 0o644 << 16, fields[2]
+            ) + name + extra)
+        directory = b''.join(parts)
+        count, start, length = len(self.central), self.offset, len(directory)
+        if count >= 0xFFFF or start >= self.LIMIT or length >= self.LIMIT:
+            end64 = start + length
+            directory += self.END64.pack(0x06064b50, 44, 45, 45, 0, 0, count, count, length, start)
+            directory += self.LOCATOR64.pack(0x07064b50, 0, end64, 1)
+            count, start, length = min(count, 0xFFFF), min(start, self.LIMIT), min(length, self.LIMIT)
+        return directory + self.END.pack(0x06054b50, 0, 0, count, count, length, start, 0)
+
+def stream_zip(versions, level=ARCHIVE_LEVEL):
+    # Yields a chunk per version as entries finish compressing; the whole
+    # archive is never held in memory.
+    writer = ZipWriter()
+    method = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+    compress = lambda name, data: _deflate_entry(data, level)
+    for entries in _compressed_entries(versions, compress, 'zip'):
+        with timed('zip'):
+            chunk = b''.join(writer.add(name, size, *result, method) for name, size, result in entries)
+        tally('compressed_bytes', len(chunk))
+        yield chunk
+    chunk = writer.finish()
+    tally('compressed_bytes', len(chunk))
+    yield chunk
+
+def stream_tar(versions, level=ARCHIVE_LEVEL):
+    # Each entry is its own gzip member, which is still one valid .tar.gz
+    # (gzip readers concatenate members) and lets entries deflate in parallel.
+    compress = lambda name, data: _tar_entry(name, data, level)
+    for entries in _compressed_entries(versions, compress, 'tar'):
+        chunk = b''.join(result for _, _, result in entries)
+        tally('compressed_bytes', len(chunk))
+        yield chunk
+    end = bytes(2 * tarfile.BLOCKSIZE)
+    chunk = gzip_bytes(end, level) if level else end
+    tally('compressed_bytes', len(chunk))
+    yield chunk
+
+def stream_archive(versions, archive=Archive()):
+    stream = stream_zip if archive.format == 'zip' else stream_tar
+    return stream(versions, archive.level)
+
+class MemoryCache:
+    # LRU over an OrderedDict, bounded by total value bytes and entry age.
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored, data = entry
+            if time.time() - stored > self.ttl:
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.time(), data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        self.size -= len(self.entries.pop(key)[1])
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size}
+
+class DiskCache:
+    # Same policy with one file per key, so every worker on the host shares
+    # entries. A file's mtime is when it was stored (TTL), its atime when it
+    # was last read (LRU order).
+    def __init__(self, path, max_bytes, ttl):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def get(self, key):
+        path = os.path.join(self.path, key)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.ttl:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, (time.time(), st.st_mtime))
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.path, key))
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    st = entry.stat()
+                    entries.append((st.st_atime, st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        now = time.time()
+        live = []
+        for atime, mtime, size, path in self._entries():
+            if now - mtime > self.ttl:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+            else:
+                live.append((atime, size, path))
+        live.sort()
+        total = sum(size for _, size, _ in live)
+        for _, size, path in live:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {'entries': len(entries), 'bytes': sum(e[2] for e in entries)}
+
+class ArtifactCache:
+    # Counts hits and misses per kind of artifact ("bank", "archive"). The
+    # counters are per process; the entries are shared when the store is.
+    def __init__(self, store):
+        self.store = store
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind, key):
+        data = self.store.get(f'{kind}-{key}')
+        with self.lock:
+            counts = self.counts.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts['hits' if data is not None else 'misses'] += 1
+        return data
+
+    def put(self, kind, key, data):
+        self.store.put(f'{kind}-{key}', data)
+
+    def stats(self):
+        with self.lock:
+            counts = {kind: dict(c) for kind, c in self.counts.items()}
+        return {'backend': type(self.store).__name__, 'pid': os.getpid(), 'counts': counts, **self.store.stats()}
+
+def make_cache():
+    max_bytes = int(os.environ.get('EXAM_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    ttl = float(os.environ.get('EXAM_CACHE_TTL', 3600))
+    path = os.environ.get('EXAM_CACHE_DIR')
+    store = DiskCache(path, max_bytes, ttl) if path else MemoryCache(max_bytes, ttl)
+    return ArtifactCache(store)
+
+cache = make_cache()
+
+def upload_key(q_file, a_file):
+    # Hashes the upload streams in chunks and rewinds them for parsing.
+    with timed('hash'):
+        return _hash_uploads(q_file, a_file)
+
+def _hash_uploads(q_file, a_file):
+    digest = hashlib.sha256()
+    for f in (q_file, a_file):
+        part = hashlib.sha256()
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            part.update(chunk)
+        f.seek(0)
+        digest.update(part.digest())
+    return digest.hexdigest()
+
+def describe_rejected(rejected, limit=5):
+    shown = '; '.join(f"{name} line {lineno}: {reason}" for name, lineno, reason in rejected[:limit])
+    more = f" (+{len(rejected) - limit} more)" if len(rejected) > limit else ''
+    return shown + more
+
+def build_bank(q_file, a_file):
+    # Returns the bank and the lines rejected while parsing it.
+    with timed('parse'):
+        return _build_bank(q_file, a_file)
+
+def _build_bank(q_file, a_file):
+    q_rejected = []
+    a_rejected = []
+    bank = parse_questions(q_file, q_rejected)
+    answers = parse_answers(a_file, a_rejected)
+    rejected = [('questions', *r) for r in q_rejected] + [('answers', *r) for r in a_rejected]
+    note = "\n⚠️ Skipped " + describe_rejected(rejected) if rejected else ''
+    if not len(bank):
+        raise InputError("❌ No questions found. Check your format!" + note)
+    if len(bank) != len(answers):
+        raise InputError(f"❌ Mismatch: {len(bank)} questions vs {len(answers)} answers" + note)
+    bank.correct = answers
+    bank.content_hash()
+    return bank, rejected
+
+def load_bank(key, q_file, a_file):
+    # Cached as the compiled bank format behind a JSON list of rejected
+    # lines, never as a pickle: entries may sit in a directory other
+    # processes can write to.
+    key = f'{key}-qbank-v{BANK_VERSION}'
+    with timed('cache'):
+        data = cache.get('bank', key)
+        if data is not None:
+            with contextlib.suppress(InputError, ValueError, struct.error):
+                size, = struct.unpack_from('<Q', data)
+                rejected = [tuple(r) for r in json.loads(data[8:8 + size].decode('utf-8'))]
+                return unpack_bank(data[8 + size:]), rejected
+    bank, rejected = build_bank(q_file, a_file)
+    with timed('cache'):
+        notes = json.dumps(rejected).encode('utf-8')
+        cache.put('bank', key, struct.pack('<Q', len(notes)) + notes + pack_bank(bank))
+    return bank, rejected
+
+def compile_bank(q_file, a_file, path):
+    bank, rejected = build_bank(q_file, a_file)
+    write_bank(bank, path)
+    return bank, rejected
+
+def stored_bank_path(bank_id):
+    return os.path.join(BANKS_DIR, f'{bank_id}.qbank')
+
+def cache_archive(chunks, key):
+    # Passes chunks through to the client and stores the archive only once
+    # the stream has completed, so an aborted download is never cached. An
+    # archive too big for the cache stops being buffered as soon as it
+    # outgrows it, keeping the stream at about one version in memory.
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > cache.store.max_bytes:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        cache.put('archive', key, b''.join(parts))
+
+def read_upload_form():
+    # The source is either the id of a compiled bank or the pair of
+    # uploaded question/answer streams.
+    bank_id = request.form.get('bank', '').strip()
+    if bank_id:
+        if not re.fullmatch(r'[0-9a-f]{64}', bank_id):
+            raise InputError(f"❌ Unknown question bank: {bank_id}")
+        source = bank_id
+    else:
+        source = (request.files['questions'].stream, request.files['answers'].stream)
+    num = int(request.form['num_versions'])
+    if not 1 <= num <= MAX_VERSIONS:
+        raise InputError(f"❌ Number of versions must be between 1 and {MAX_VERSIONS}")
+    seed = request.form.get('seed', '').strip()
+    seed = int(seed) if seed else None
+    if seed is not None and seed < 0:
+        raise InputError("❌ Seed must be a non-negative whole number")
+    return source, num, seed, read_sampling(request.form), read_archive(request.form)
+
+def read_sampling(values):
+    size = values.get('sample_size', '').strip()
+    if not size:
+        return None
+    common = values.get('common', '').strip()
+    return Sampling(
+        int(size),
+        stratify=values.get('stratify', '') not in ('', '0', 'false'),
+        common=int(common) if common else 0,
+        distinct=values.get('distinct', '') not in ('', '0', 'false')
+    )
+
+def read_compression(values):
+    # "stored", a zlib level 0-9, or the server default.
+    value = values.get('compression', '').strip().lower()
+    if not value:
+        return ARCHIVE_LEVEL
+    if value == 'stored':
+        return 0
+    if value.isdigit() and int(value) <= 9:
+        return int(value)
+    raise InputError(f"❌ Compression must be 'stored' or a level from 0 to 9, not {value!r}")
+
+def read_archive(values):
+    fmt = values.get('format', '').strip().lower() or 'zip'
+    if fmt not in ('zip', 'tar.gz'):
+        raise InputError(f"❌ Unknown archive format {fmt!r}; use zip or tar.gz")
+    return Archive(fmt, read_compression(values))
+
+def archive_chunks(source, num, seed, sampling=None, archive=Archive()):
+    # Each version is rendered, deflated and yielded before the next one is
+    # built, so only about one version is ever held in memory. `info`
+    # reports whether the archive came from cache, the run's seed (picked
+    # here when the request did not pin one) and any rejected lines.
+    if isinstance(source, str):
+        key = source
+        bank, rejected = open_bank(source), []
+    else:
+        key = upload_key(*source)
+        bank = None
+    archive_key = f'{key}-{num}-{seed}-{archive.format}{archive.level}-v{BANK_VERSION}'
+    if sampling is not None:
+        archive_key += '-' + hashlib.sha256(repr(tuple(sampling)).encode('utf-8')).hexdigest()[:16]
+    if seed is not None:
+        with timed('cache'):
+            cached = cache.get('archive', archive_key)
+        if cached is not None:
+            tally('compressed_bytes', len(cached))
+            return [cached], {'cache': 'hit', 'seed': seed}
+    if bank is None:
+        bank, rejected = load_bank(key, *source)
+    pinned = seed is not None
+    if not pinned:
+        seed = new_seed()
+    chunks = stream_archive(iter_versions(bank, num, seed, sampling=sampling), archive)
+    if pinned:
+        chunks = cache_archive(chunks, archive_key)
+    return chunks, {'cache': 'miss', 'seed': seed, 'rejected': rejected}
+
+def archive_response(chunks, archive, headers=None):
+    name, mimetype = archive_type(archive)
+    return Response(
+        chunks,
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={name}', **(headers or {})}
+    )
+
+class Histogram:
+    # Prometheus histogram, optionally split by one label. Bucket counts are
+    # kept per bucket and made cumulative when rendered.
+    def __init__(self, name, doc, buckets, label=None):
+        self.name, self.doc, self.buckets, self.label = name, doc, buckets, label
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value=''):
+        with self.lock:
+            counts = self.series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((k, list(v)) for k, v in self.series.items())
+        for label_value, counts in series:
+            labels = [(self.label, label_value)] if self.label else []
+            total = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                total += count
+                lines.append(f'{self.name}_bucket{prom_labels(labels + [("le", bound)])} {total}')
+            lines.append(f'{self.name}_sum{prom_labels(labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{prom_labels(labels)} {total}')
+        return lines
+
+class Counter:
+    def __init__(self, name, doc, labels):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append(f'{self.name}{prom_labels(zip(self.labels, label_values))} {value}')
+        return lines
+
+def prom_labels(pairs):
+    pairs = [f'{k}="{v}"' for k, v in pairs]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (10**3, 10**4, 10**5, 10**6, 10**7, 10**8, 10**9)
+
+# Per process, like the cache counters: with several gunicorn workers each
+# scrape sees the worker that answered it.
+REQUEST_SECONDS = Histogram('exam_request_seconds', 'Time from request to last byte sent.', SECONDS_BUCKETS, 'endpoint')
+STAGE_SECONDS = Histogram('exam_stage_seconds', 'Time spent in each generation stage.', SECONDS_BUCKETS, 'stage')
+SIZE_HISTOGRAMS = {
+    'questions': Histogram('exam_bank_questions', 'Questions in the bank used.', (10, 100, 10**3, 10**4, 10**5, 10**6)),
+    'versions': Histogram('exam_versions', 'Versions rendered per request.', (1, 2, 5, 10, 26, 50, 100, 250, 500, 1000)),
+    'output_bytes': Histogram('exam_output_bytes', 'Uncompressed text bytes per archive.', BYTES_BUCKETS),
+    'compressed_bytes': Histogram('exam_compressed_bytes', 'Archive bytes sent.', BYTES_BUCKETS),
+}
+REQUESTS = Counter('exam_requests_total', 'Requests handled.', ('endpoint', 'status'))
+ERRORS = Counter('exam_errors_total', 'Requests or jobs that failed, by exception type.', ('endpoint', 'error'))
+
+# Requests slower than EXAM_PROFILE_SLOW seconds leave a pyinstrument report
+# in EXAM_PROFILE_DIR; off unless both the variable and pyinstrument are set.
+PROFILE_SLOW = float(os.environ.get('EXAM_PROFILE_SLOW', 0))
+PROFILE_DIR = os.environ.get('EXAM_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'exam-profiles'))
+def start_profiler():
+    if not PROFILE_SLOW or Profiler is None:
+        return None
+    profiler = Profiler(interval=0.001)
+    profiler.start()
+    return profiler
+
+def finish_trace(trace, endpoint, status, profiler=None):
+    elapsed = trace.elapsed()
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    REQUESTS.inc(endpoint, str(status))
+    if trace.error:
+        ERRORS.inc(endpoint, trace.error)
+    for stage, seconds in trace.stages.items():
+        STAGE_SECONDS.observe(seconds, stage)
+    for name, histogram in SIZE_HISTOGRAMS.items():
+        if name in trace.sizes:
+            histogram.observe(trace.sizes[name])
+    if profiler is not None:
+        profiler.stop()
+        if elapsed >= PROFILE_SLOW:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}.html"
+            with open(os.path.join(PROFILE_DIR, name), 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+
+def traced_stream(chunks, trace, done):
+    # Runs each step of a streamed body under the request's trace, and
+    # finishes it once the last chunk is sent or the client goes away.
+    chunks = iter(chunks)
+    try:
+        while True:
+            token = current_trace.set(trace)
+            try:
+                chunk = next(chunks, None)
+            except Exception as e:
+                trace.error = type(e).__name__
+                raise
+            finally:
+                current_trace.reset(token)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        with contextlib.suppress(Exception):
+            getattr(chunks, 'close', lambda: None)()
+        done()
+
+def instrumented(view):
+    # Times the view and its streamed body. Stages that ran before the
+    # response started go out in Server-Timing; all of them go to /metrics.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        trace = Trace()
+        profiler = start_profiler()
+        token = current_trace.set(trace)
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception as e:
+            trace.error = type(e).__name__
+            finish_trace(trace, view.__name__, 500, profiler)
+            raise
+        finally:
+            current_trace.reset(token)
+        response.headers['Server-Timing'] = trace.server_timing()
+        done = functools.partial(finish_trace, trace, view.__name__, response.status_code, profiler)
+        if response.is_streamed:
+            response.response = traced_stream(response.response, trace, done)
+        else:
+            done()
+        return response
+    return wrapper
+
+def failure(e):
+    # Error response for a failed request. Bad or missing form fields are
+    # the client's (400); anything else is a server bug, logged with its
+    # traceback and answered with 500. Both are counted.
+    trace = current_trace.get()
+    if trace is not None:
+        trace.error = type(e).__name__
+    if isinstance(e, InputError):
+        return str(e), 400
+    if isinstance(e, (ValueError, KeyError)):
+        return f"❌ Error: {str(e)}", 400
+    app.logger.exception("Request failed")
+    return f"❌ Error: {str(e)}", 500
+
 app = Flask(__name__)
+if PROFILE_SLOW and Profiler is None:
+    app.logger.warning("⚠️ EXAM_PROFILE_SLOW is set but pyinstrument is not installed; profiling is off")
 
 @app.route('/img/<path:filename>')
 def serve_image(filename):
     return send_from_directory('img', filename)
 
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    lines = []
+    for metric in (REQUESTS, ERRORS, REQUEST_SECONDS, STAGE_SECONDS, *SIZE_HISTOGRAMS.values()):
+        lines += metric.render()
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 HTML = '''<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -143,8 +1336,12 @@ input[type=file]{display:none}
 .num-btn{width:54px;height:54px;border:none;border-radius:13px;background:linear-gradient(135deg,#667eea,#764ba2);color:#fff;font-size:28px;font-weight:700;cursor:pointer;transition:all .3s;box-shadow:0 4px 15px rgba(102,126,234,.3);display:flex;align-items:center;justify-content:center}
 .num-btn:hover{transform:scale(1.1);box-shadow:0 6px 20px rgba(102,126,234,.5)}
 .num-btn:active{transform:scale(.95)}
-.num-display{width:110px;height:70px;background:var(--up-bg);border:2.5px solid var(--border);border-radius:16px;display:flex;align-items:center;justify-content:center;font-size:42px;font-weight:800;color:var(--primary);box-shadow:inset 0 2px 8px var(--shadow)}
+.num-display{width:140px;text-align:center;font-family:inherit;height:70px;background:var(--up-bg);border:2.5px solid var(--border);border-radius:16px;display:flex;align-items:center;justify-content:center;font-size:42px;font-weight:800;color:var(--primary);box-shadow:inset 0 2px 8px var(--shadow)}
 .num-label{text-align:center;margin-top:15px;font-size:14px;color:var(--light);font-weight:500}
+.opt-row{display:flex;align-items:center;justify-content:center;flex-wrap:wrap;gap:12px;margin-top:20px;font-size:14px;font-weight:600;color:var(--light)}
+.opt-row input[type=number]{width:140px;padding:10px 14px;background:var(--up-bg);border:2px solid var(--border);border-radius:12px;color:var(--text);font-size:14px;font-weight:600}
+.opt-row select{padding:10px 14px;background:var(--up-bg);border:2px solid var(--border);border-radius:12px;color:var(--text);font-size:14px;font-weight:600}
+.opt-row input[type=checkbox]{width:18px;height:18px;accent-color:var(--primary)}
 .summary-box{background:var(--up-bg);border:2px solid var(--border);border-radius:14px;padding:14px;margin:14px 0}
 .summary-item{display:flex;align-items:center;gap:8px;padding:9px;margin-bottom:7px;background:var(--card);border-radius:10px;border:1px solid var(--border)}
 .summary-item:last-child{margin-bottom:0}
@@ -259,11 +1456,15 @@ Q4: D
 </div>
 <div class="number-selector">
 <button type="button" class="num-btn" onclick="chgNum(-1)">−</button>
-<div class="num-display" id="numDisp">2</div>
+<input type="number" class="num-display" id="numDisp" value="2" min="2" max="{{ max_versions }}" oninput="setNum(this.value)">
 <button type="button" class="num-btn" onclick="chgNum(1)">+</button>
 </div>
 <input type="hidden" id="numVer" name="num_versions" value="2">
 <div class="num-label">✨ Each version gets unique question order and shuffled choices | 🔒 Perfect for preventing cheating</div>
+<div class="opt-row"><label for="seed">🎲 Seed (optional)</label><input type="number" id="seed" name="seed" min="0" placeholder="Random"></div>
+<div class="opt-row"><label for="sampleSize">📚 Questions per version</label><input type="number" id="sampleSize" name="sample_size" min="1" placeholder="All"><label for="common">🔗 Shared by all</label><input type="number" id="common" name="common" min="0" placeholder="0"></div>
+<div class="opt-row"><label><input type="checkbox" name="stratify"> Balance topics</label><label><input type="checkbox" name="distinct"> No repeats between consecutive versions</label></div>
+<div class="opt-row"><label for="format">🗜️ Download as</label><select id="format" name="format"><option value="zip">ZIP</option><option value="tar.gz">TAR.GZ</option></select><select name="compression"><option value="">Compressed</option><option value="9">Smallest</option><option value="stored">Uncompressed (fastest)</option></select></div>
 </div>
 <div class="slide" id="slide4">
 <div class="slide-header">
@@ -311,52 +1512,278 @@ function toggleTheme(){const d=document.body.classList.toggle('dark'),t=document
 if(localStorage.theme==='dark'){document.body.classList.add('dark');document.getElementById('themeText').textContent='Dark'}
 function fileUp(s){const f=document.getElementById(s===1?'qFile':'aFile'),b=document.getElementById('upBox'+s),t=document.getElementById('upText'+s);if(f.files&&f.files[0]){b.classList.add('uploading');t.textContent='⏳ Uploading...';setTimeout(()=>{const n=f.files[0].name;b.classList.remove('uploading');b.classList.add('uploaded');t.textContent='✓ '+n;if(s===1){hasQ=true;qName=n}else{hasA=true;aName=n}chkNext()},500)}}
 function chkNext(){const btn=document.getElementById('btnNext');btn.disabled=!((step===1&&hasQ)||(step===2&&hasA)||(step===3))}
-function chgNum(d){numV=Math.max(2,Math.min(26,numV+d));document.getElementById('numDisp').textContent=numV;document.getElementById('numVer').value=numV;updSum();chkNext()}
-function updSum(){document.getElementById('sumQ').textContent=qName||'Not uploaded';document.getElementById('sumA').textContent=aName||'Not uploaded';const v=Array.from({length:numV},(_,i)=>String.fromCharCode(65+i)).join(', ');document.getElementById('sumN').textContent=numV+' versions ('+v+')'}
+function chgNum(d){setNum(numV+d);document.getElementById('numDisp').value=numV}
+function setNum(n){n=parseInt(n,10);if(isNaN(n))return;numV=Math.max(2,Math.min({{ max_versions }},n));document.getElementById('numVer').value=numV;updSum();chkNext()}
+function verLabel(i){let s='';for(i++;i;i=Math.floor((i-1)/26))s=String.fromCharCode(65+(i-1)%26)+s;return s}
+function updSum(){document.getElementById('sumQ').textContent=qName||'Not uploaded';document.getElementById('sumA').textContent=aName||'Not uploaded';const v=numV<=6?Array.from({length:numV},(_,i)=>verLabel(i)).join(', '):[0,1,2].map(verLabel).join(', ')+', … '+verLabel(numV-1);document.getElementById('sumN').textContent=numV+' versions ('+v+')'}
 function updProg(){const p=document.getElementById('progLine');p.style.width=((step-1)/3*100)+'%';for(let i=1;i<=4;i++){const e=document.getElementById('step'+i);e.classList.remove('active','completed');if(i<step)e.classList.add('completed');else if(i===step)e.classList.add('active')}}
 function next(){if(step<4){document.getElementById('slide'+step).classList.remove('active');document.getElementById('slide'+step).classList.add('prev');step++;const s=document.getElementById('slide'+step);s.classList.remove('prev');s.classList.add('active');updNav();updProg();chkNext();if(step===4)updSum()}}
 function prev(){if(step>1){document.getElementById('slide'+step).classList.remove('active','prev');step--;const s=document.getElementById('slide'+step);s.classList.add('active');s.classList.remove('prev');updNav();updProg();chkNext()}}
 function updNav(){const back=document.getElementById('btnBack'),next=document.getElementById('btnNext'),gen=document.getElementById('btnGen');back.style.display=step>1?'flex':'none';next.style.display=step<4?'flex':'none';gen.style.display=step===4?'flex':'none'}
-document.getElementById('form').onsubmit=function(e){e.preventDefault();const btn=document.getElementById('btnGen');btn.innerHTML='<span style="animation:spin 1s linear infinite">⚙️</span><span>Generating...</span>';btn.disabled=true;const formData=new FormData(this);fetch('/',{method:'POST',body:formData}).then(response=>{console.log('Response status:',response.status);if(!response.ok){return response.text().then(txt=>{throw new Error(txt||'Generation failed')})}return response.blob()}).then(blob=>{console.log('Blob size:',blob.size);if(blob.size<100){throw new Error('Invalid file generated')}const url=URL.createObjectURL(blob);const a=document.createElement('a');a.href=url;a.download='exam_papers.zip';document.body.appendChild(a);a.click();document.body.removeChild(a);URL.revokeObjectURL(url);btn.innerHTML='<span>✅</span><span>Success!</span>';btn.style.background='linear-gradient(135deg,#10b981,#059669)';setTimeout(()=>location.reload(),2000)}).catch(err=>{console.error('Error:',err);btn.innerHTML='<span>✨</span><span>Generate</span>';btn.disabled=false;alert('Error: '+err.message)})};
+document.getElementById('form').onsubmit=function(e){e.preventDefault();const btn=document.getElementById('btnGen');btn.innerHTML='<span style="animation:spin 1s linear infinite">⚙️</span><span>Generating...</span>';btn.disabled=true;const formData=new FormData(this);fetch('/jobs',{method:'POST',body:formData}).then(response=>{if(!response.ok){return response.text().then(txt=>{throw new Error(txt||'Generation failed')})}return response.json()}).then(job=>pollJob(job.id,btn)).catch(err=>genFail(btn,err))};
+const JOB_MAX_WAIT=30*60*1000;
+function pollJob(id,btn,since){since=since||Date.now();if(Date.now()-since>JOB_MAX_WAIT){genFail(btn,new Error('Gave up waiting for the server; please try again'));return}fetch('/jobs/'+id).then(response=>response.json().then(job=>{if(!response.ok||job.state==='failed')throw new Error(job.error||'Generation failed');return job})).then(job=>{if(job.state!=='done'){btn.innerHTML='<span style="animation:spin 1s linear infinite">⚙️</span><span>Generating... '+job.done+'/'+job.total+'</span>';setTimeout(()=>pollJob(id,btn,since),700);return}const a=document.createElement('a');a.href='/jobs/'+id+'/download';a.download='';document.body.appendChild(a);a.click();document.body.removeChild(a);btn.innerHTML='<span>✅</span><span>Success!</span>';btn.style.background='linear-gradient(135deg,#10b981,#059669)';setTimeout(()=>location.reload(),2000)}).catch(err=>genFail(btn,err))}
+function genFail(btn,err){console.error('Error:',err);btn.innerHTML='<span>✨</span><span>Generate</span>';btn.disabled=false;alert('Error: '+err.message)}
 updNav();updProg();
 </script>
 </body>
 </html>'''
 
 @app.route('/', methods=['GET', 'POST'])
+@instrumented
 def index():
     if request.method == 'POST':
         try:
-            q_file = request.files['questions']
-            a_file = request.files['answers']
-            num = int(request.form['num_versions'])
-            
-            questions = parse_questions(q_file.read().decode('utf-8'))
-            answers = parse_answers(a_file.read().decode('utf-8'))
-            
-            if not questions:
-                return "❌ No questions found. Check your format!", 400
-            if len(questions) != len(answers):
-                return f"❌ Mismatch: {len(questions)} questions vs {len(answers)} answers", 400
-            
-            files = generate_all(questions, answers, num)
-            
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for name, content in files.items():
-                    zf.writestr(name, content.encode('utf-8'))
-            
-            zip_buffer.seek(0)
-            return send_file(
-                zip_buffer,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name='exam_papers.zip'
-            )
+            source, num, seed, sampling, archive = read_upload_form()
+            chunks, info = archive_chunks(source, num, seed, sampling, archive)
+            headers = {'X-Exam-Cache': info['cache'], 'X-Exam-Seed': str(info['seed'])}
+            if info.get('rejected'):
+                headers['X-Exam-Rejected'] = f"{len(info['rejected'])}; {describe_rejected(info['rejected'])}"
+            return archive_response(chunks, archive, headers)
         except Exception as e:
-            return f"❌ Error: {str(e)}", 400
+            return failure(e)
     
-    return render_template_string(HTML)
+    return render_template_string(HTML, max_versions=MAX_VERSIONS)
+
+@app.route('/banks', methods=['POST'])
+@instrumented
+def create_bank():
+    try:
+        q_file = request.files['questions'].stream
+        a_file = request.files['answers'].stream
+        bank_id = upload_key(q_file, a_file)
+        path = stored_bank_path(bank_id)
+        rejected = []
+        if not os.path.exists(path):
+            os.makedirs(BANKS_DIR, exist_ok=True)
+            _, rejected = compile_bank(q_file, a_file, path)
+        bank = open_bank(bank_id)
+    except Exception as e:
+        return failure(e)
+    body = {'id': bank_id, 'questions': len(bank)}
+    if rejected:
+        body['rejected'] = describe_rejected(rejected)
+    return jsonify(body), 201, {'Location': url_for('bank_info', bank_id=bank_id)}
+
+@app.route('/banks/<bank_id>')
+def bank_info(bank_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', bank_id):
+        return jsonify(error='Unknown question bank'), 404
+    try:
+        bank = open_bank(bank_id)
+    except InputError:
+        return jsonify(error='Unknown question bank'), 404
+    return jsonify(id=bank_id, questions=len(bank))
+
+@app.route('/runs/<int:seed>/versions/<label>')
+@instrumented
+def run_version(seed, label):
+    # Re-renders one version of a seeded run over a stored bank, e.g.
+    # /runs/42/versions/Q?bank=<id> or ...&answers=1 for its key. The same
+    # sampling parameters as the form apply.
+    index = label_index(label)
+    bank_id = request.args.get('bank', '')
+    if index is None or index >= MAX_VERSIONS or not re.fullmatch(r'[0-9a-f]{64}', bank_id):
+        return "❌ Unknown version or question bank", 404
+    try:
+        files = render_single(bank_id, seed, index, read_sampling(request.args))
+        level = read_compression(request.args)
+    except Exception as e:
+        return failure(e)
+    kind = 'answers' if request.args.get('answers', '') not in ('', '0', 'false') else 'exam'
+    name = f'{kind}_version_{label}.txt'
+    body = files[name].encode('utf-8')
+    headers = {'Content-Disposition': f'inline; filename={name}', 'X-Exam-Seed': str(seed), 'Vary': 'Accept-Encoding'}
+    # gzip only for clients that accept it and when compression is wanted;
+    # identity is the cheap path for LAN clients and `compression=stored`.
+    if level and request.accept_encodings['gzip']:
+        with timed('gzip'):
+            body = gzip_bytes(body, level)
+        headers['Content-Encoding'] = 'gzip'
+    tally('compressed_bytes', len(body))
+    return Response(body, mimetype='text/plain', headers=headers)
+
+JOBS_DIR = os.environ.get('EXAM_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'exam-jobs'))
+JOB_TTL = float(os.environ.get('EXAM_JOB_TTL', 3600))
+JOB_MAX = int(os.environ.get('EXAM_JOB_MAX', 100))
+JOB_STALE = float(os.environ.get('EXAM_JOB_STALE', 60))
+job_executor = ThreadPoolExecutor(int(os.environ.get('EXAM_JOB_THREADS', 2)))
+HOST = socket.gethostname()
+
+# Job state lives in JOBS_DIR as <id>.json next to the finished
+# <id>.archive, so whichever worker receives a poll can answer it.
+def job_path(job_id, ext):
+    return os.path.join(JOBS_DIR, f'{job_id}.{ext}')
+
+def write_job(job_id, status):
+    fd, tmp = tempfile.mkstemp(dir=JOBS_DIR, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'id': job_id, **status}, f)
+    os.replace(tmp, job_path(job_id, 'json'))
+
+def read_job(job_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    try:
+        with open(job_path(job_id, 'json')) as f:
+            status = json.load(f)
+            heartbeat = os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        return None
+    # The status file's mtime is the owning worker's heartbeat. A job whose
+    # worker has exited, or has gone quiet for JOB_STALE seconds, will never
+    # finish, so it is reported as failed instead of pending forever.
+    status['heartbeat'] = heartbeat
+    if status['state'] in ('queued', 'running'):
+        gone = status.get('host') == HOST and not pid_alive(status.get('pid'))
+        if gone or time.time() - heartbeat > JOB_STALE:
+            status.update(state='failed', error="❌ The server stopped while generating; please try again")
+    return status
+
+def pid_alive(pid):
+    if pid is None or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Jobs queued or running in this process; a daemon thread touches their
+# status files so other workers can tell they are still alive.
+_owned_jobs = set()
+_heartbeat_thread = None
+
+def _heartbeat():
+    while True:
+        time.sleep(JOB_STALE / 6)
+        for job_id in list(_owned_jobs):
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(job_path(job_id, 'json'))
+
+def own_job(job_id):
+    global _heartbeat_thread
+    _owned_jobs.add(job_id)
+    if _heartbeat_thread is None:
+        _heartbeat_thread = threading.Thread(target=_heartbeat, name='job-heartbeat', daemon=True)
+        _heartbeat_thread.start()
+
+def sweep_jobs():
+    # Jobs are dropped once untouched for JOB_TTL seconds, and beyond the
+    # JOB_MAX most recent ones; abandoned temp files age out the same way.
+    os.makedirs(JOBS_DIR, mode=0o700, exist_ok=True)
+    now = time.time()
+    jobs = []
+    with os.scandir(JOBS_DIR) as it:
+        for entry in it:
+            with contextlib.suppress(FileNotFoundError):
+                mtime = entry.stat().st_mtime
+                if entry.name.startswith('.tmp-'):
+                    if now - mtime > JOB_TTL:
+                        os.unlink(entry.path)
+                elif entry.name.endswith('.json'):
+                    jobs.append((mtime, entry.name[:-5]))
+    jobs.sort(reverse=True)
+    for i, (mtime, job_id) in enumerate(jobs):
+        if i >= JOB_MAX or now - mtime > JOB_TTL:
+            for ext in ('archive', 'json'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(job_path(job_id, ext))
+
+def run_job(job_id, status, source, num, seed, sampling, archive):
+    status['state'] = 'running'
+    uploads = () if isinstance(source, str) else source
+    trace = Trace()
+    profiler = start_profiler()
+    token = current_trace.set(trace)
+    fd, tmp = tempfile.mkstemp(dir=JOBS_DIR, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f, contextlib.ExitStack() as files:
+            if uploads:
+                source = tuple(files.enter_context(open(path, 'rb')) for path in uploads)
+            chunks, info = archive_chunks(source, num, seed, sampling, archive)
+            status['seed'] = info['seed']
+            if info.get('rejected'):
+                status['rejected'] = describe_rejected(info['rejected'])
+            write_job(job_id, status)
+            for chunk in chunks:
+                f.write(chunk)
+                status['done'] = min(status['done'] + 1, num)
+                write_job(job_id, status)
+        os.replace(tmp, job_path(job_id, 'archive'))
+        status.update(state='done', done=num, bytes=os.path.getsize(job_path(job_id, 'archive')))
+    except InputError as e:
+        trace.error = type(e).__name__
+        status.update(state='failed', error=str(e))
+    except Exception as e:
+        trace.error = type(e).__name__
+        app.logger.exception("Job %s failed", job_id)
+        status.update(state='failed', error=f"❌ Error: {str(e)}")
+    finally:
+        current_trace.reset(token)
+        for path in (tmp, *uploads):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+    status['finished'] = time.time()
+    status['timings'] = {stage: round(seconds * 1000, 1) for stage, seconds in trace.stages.items()}
+    finish_trace(trace, 'job', status['state'], profiler)
+    write_job(job_id, status)
+    _owned_jobs.discard(job_id)
+
+@app.route('/jobs', methods=['POST'])
+@instrumented
+def create_job():
+    try:
+        source, num, seed, sampling, archive = read_upload_form()
+    except Exception as e:
+        return failure(e)
+    sweep_jobs()
+    job_id = uuid.uuid4().hex
+    if not isinstance(source, str):
+        # Uploads are spooled to disk because the request's file streams
+        # are closed as soon as this handler returns; mkstemp keeps the
+        # answer keys readable by this user only.
+        paths = []
+        for name, stream in zip(('questions', 'answers'), source):
+            fd, path = tempfile.mkstemp(dir=JOBS_DIR, prefix=f'.tmp-{job_id}-{name}-')
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+            paths.append(path)
+        source = tuple(paths)
+    status = {'state': 'queued', 'done': 0, 'total': num, 'format': archive.format, 'level': archive.level,
+              'created': time.time(), 'host': HOST, 'pid': os.getpid()}
+    write_job(job_id, status)
+    own_job(job_id)
+    response = jsonify(id=job_id, **status)
+    job_executor.submit(run_job, job_id, status, source, num, seed, sampling, archive)
+    return response, 202, {'Location': url_for('job_status', job_id=job_id)}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = read_job(job_id)
+    if status is None:
+        return jsonify(error='Unknown or expired job'), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    status = read_job(job_id)
+    if status is None:
+        return jsonify(error='Unknown or expired job'), 404
+    if status['state'] != 'done':
+        return jsonify(status), 409
+    name, mimetype = archive_type(Archive(status.get('format', 'zip'), status.get('level', ARCHIVE_LEVEL)))
+    try:
+        return send_file(
+            job_path(job_id, 'archive'),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=name
+        )
+    except FileNotFoundError:
+        return jsonify(error='Unknown or expired job'), 404
 
 if __name__ == '__main__':
     print("\n" + "="*60)
@@ -0,0 +1,232 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Run from anywhere; the app is imported from the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('EXAM_WORKERS', '1')
+os.environ.setdefault('EXAM_MAX_VERSIONS', str(10**6))
+
+import numpy as np
+
+import app
+from app import generate_all, iter_versions, parse_answers, parse_questions, shuffle_exam, stream_zip
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+WORDS = ('atom', 'river', 'matrix', 'protein', 'empire', 'vector', 'sonnet', 'glacier', 'market', 'neuron',
+         'prism', 'treaty', 'enzyme', 'orbit', 'ledger', 'canyon', 'theorem', 'harbor', 'quartz', 'fable')
+
+def synthetic_bank(num_questions, seed=0):
+    # Questions/answers files in the upload format, with topic tags and
+    # stems and choices of varying length. The same seed gives the same bytes.
+    rng = random.Random(seed)
+    questions = []
+    answers = []
+    for i in range(1, num_questions + 1):
+        stem = ' '.join(rng.choices(WORDS, k=rng.randint(6, 18)))
+        questions.append(f"Q{i} [Topic {i % 7}]: {stem.capitalize()}?")
+        for letter in 'ABCD':
+            questions.append(f"{letter}) " + ' '.join(rng.choices(WORDS, k=rng.randint(1, 5))))
+        questions.append('')
+        answers.append(f"Q{i}: {rng.choice('ABCD')}")
+    return '\n'.join(questions).encode('utf-8'), '\n'.join(answers).encode('utf-8')
+
+def measure(fn, repeat, memory):
+    # Best wall time of `repeat` runs, then one extra run under tracemalloc
+    # for the peak, since tracing distorts the timings.
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+def post_form(client, q_bytes, a_bytes, num_versions, seed):
+    response = client.post('/', data={
+        'questions': (io.BytesIO(q_bytes), 'questions.txt'),
+        'answers': (io.BytesIO(a_bytes), 'answers.txt'),
+        'num_versions': str(num_versions),
+        'seed': str(seed),
+    }, content_type='multipart/form-data')
+    body = response.get_data()
+    if response.status_code != 200:
+        raise RuntimeError(body.decode('utf-8', 'replace'))
+    return body
+
+def cases(sizes, versions, max_work):
+    # (stage, questions, versions) in the order they run. Stages that depend
+    # on the version count are skipped past `max_work` questions rendered.
+    for n in sizes:
+        yield 'parse_questions', n, 0
+        yield 'parse_answers', n, 0
+        yield 'shuffle_exam', n, 1
+        for v in versions:
+            if n * v <= max_work:
+                yield 'generate_all', n, v
+                yield 'zip', n, v
+                yield 'request', n, v
+
+def load_case_bank(n):
+    q_bytes, a_bytes = synthetic_bank(n)
+    bank = parse_questions(q_bytes)
+    bank.correct = parse_answers(a_bytes)
+    return q_bytes, a_bytes, bank
+
+def run_case(stage, n, v, case_bank, args):
+    q_bytes, a_bytes, bank = case_bank
+    rendered = n * max(v, 1)
+    if stage == 'parse_questions':
+        fn = lambda: parse_questions(io.BytesIO(q_bytes))
+        work, unit = len(q_bytes), 'MB/s'
+    elif stage == 'parse_answers':
+        fn = lambda: parse_answers(io.BytesIO(a_bytes))
+        work, unit = len(a_bytes), 'MB/s'
+    elif stage == 'shuffle_exam':
+        fn = lambda: shuffle_exam(bank, np.random.default_rng(0))
+        work, unit = rendered, 'questions/s'
+    elif stage == 'generate_all':
+        fn = lambda: generate_all(bank, v, seed=0, workers=args.workers)
+        work, unit = rendered, 'questions/s'
+    elif stage == 'zip':
+        versions = list(iter_versions(bank, v, seed=0, workers=args.workers))
+        fn = lambda: sum(len(chunk) for chunk in stream_zip(iter(versions), args.level))
+        work = sum(len(text.encode('utf-8')) for files in versions for text in files.values())
+        unit = 'MB/s'
+    else:
+        client = app.app.test_client()
+        def fn():
+            # A cold request each time: no parsed bank or archive to reuse.
+            app.cache = app.make_cache()
+            post_form(client, q_bytes, a_bytes, v, seed=0)
+        work, unit = rendered, 'questions/s'
+    seconds, peak = measure(fn, args.repeat, args.memory)
+    rate = work / seconds if seconds else float('inf')
+    if unit == 'MB/s':
+        rate /= 1e6
+    return {'stage': stage, 'questions': n, 'versions': v, 'seconds': seconds,
+            'throughput': rate, 'unit': unit, 'peak_bytes': peak}
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True)
+    except OSError:
+        return None
+    if out.returncode:
+        return None
+    return out.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+def format_bytes(size):
+    if size is None:
+        return '-'
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+def print_row(result, file=sys.stdout):
+    print(f"{result['stage']:<16}{result['questions']:>8}{result['versions']:>6}"
+          f"{result['seconds'] * 1000:>12.2f} ms{result['throughput']:>14.1f} {result['unit']:<12}"
+          f"{format_bytes(result['peak_bytes']):>11}", file=file, flush=True)
+
+def compare(previous, results, threshold):
+    # Matches cases by (stage, questions, versions) and flags any that got
+    # slower by more than `threshold`. Returns the number of regressions.
+    old = {(r['stage'], r['questions'], r['versions']): r for r in previous['results']}
+    print(f"\nCompared with {previous['meta'].get('commit') or 'previous run'}:")
+    regressions = 0
+    for r in results:
+        before = old.get((r['stage'], r['questions'], r['versions']))
+        if before is None:
+            continue
+        ratio = r['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  ⚠️ slower'
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = '  ✅ faster'
+        print(f"{r['stage']:<16}{r['questions']:>8}{r['versions']:>6}"
+              f"{before['seconds'] * 1000:>12.2f} ms ->{r['seconds'] * 1000:>10.2f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the exam generator stages on synthetic banks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help="questions per bank")
+    parser.add_argument('--versions', type=int, nargs='+', default=[1, 10, 50], help="versions per run")
+    parser.add_argument('--max-work', type=int, default=2_000_000,
+                        help="skip runs that render more than this many questions in total")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case; the best is kept")
+    parser.add_argument('--workers', type=int, default=1, help="render processes for generate_all")
+    parser.add_argument('--level', type=int, default=app.ARCHIVE_LEVEL, help="compression level for the zip stage")
+    parser.add_argument('--stages', nargs='+', help="only run these stages")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc peak run")
+    parser.add_argument('-o', '--output', help="results file (default: bench/results/<commit>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown ratio reported as a regression (exit status 1)")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    meta = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'workers': args.workers,
+        'level': args.level,
+        'archive_threads': app.ARCHIVE_THREADS,
+    }
+    print(f"{'stage':<16}{'questions':>8}{'vers':>6}{'best':>15}{'throughput':>15}{'':<12}{'peak':>11}")
+    results = []
+    banks = {}
+    for stage, n, v in cases(args.sizes, args.versions, args.max_work):
+        if args.stages and stage not in args.stages:
+            continue
+        if n not in banks:
+            banks.clear()
+            banks[n] = load_case_bank(n)
+        result = run_case(stage, n, v, banks[n], args)
+        results.append(result)
+        print_row(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print(f"\n✅ Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare(previous, results, args.threshold)
+        if regressions:
+            sys.exit(f"❌ {regressions} case(s) slower than x{args.threshold}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app import (
+    ARCHIVE_LEVEL, BANK_VERSION, BANKS_DIR, FILE_MODE, InputError, Sampling, build_bank, compile_bank,
+    iter_versions, new_seed, open_bank, stored_bank_path, stream_zip, upload_key
+)
+
+def compile_command(args):
+    with open(args.questions, 'rb') as q_file, open(args.answers, 'rb') as a_file:
+        if args.output:
+            path = args.output
+        else:
+            # Same id the web app gives the same pair of files.
+            os.makedirs(BANKS_DIR, exist_ok=True)
+            path = stored_bank_path(upload_key(q_file, a_file))
+        bank, rejected = compile_bank(q_file, a_file, path)
+    for name, lineno, reason in rejected:
+        print(f"⚠️  {name} line {lineno}: {reason}", file=sys.stderr)
+    print(f"✅ {len(bank)} questions -> {path}")
+
+def manifest_int(entry, field, i, default=None, minimum=0):
+    value = entry.get(field, default)
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        value = int(value)
+    except (TypeError, ValueError):
+        raise InputError(f"❌ Manifest entry {i}: {field} must be a whole number, not {value!r}") from None
+    if value < minimum:
+        raise InputError(f"❌ Manifest entry {i}: {field} must be at least {minimum}")
+    return value
+
+def manifest_sampling(entry, i):
+    # Same fields as the web form; they are checked here so a bad entry is
+    # reported before any bank runs rather than failing inside a worker.
+    size = manifest_int(entry, 'sample_size', i, minimum=1)
+    stratify = entry.get('stratify', False)
+    if not isinstance(stratify, (bool, dict)):
+        raise InputError(f"❌ Manifest entry {i}: stratify must be true/false or an object of topic counts")
+    if isinstance(stratify, dict):
+        stratify = {str(topic): manifest_int(stratify, topic, i) for topic in stratify}
+    common = manifest_int(entry, 'common', i, default=0)
+    distinct = entry.get('distinct', False)
+    if not isinstance(distinct, bool):
+        raise InputError(f"❌ Manifest entry {i}: distinct must be true or false")
+    if size is None and not isinstance(stratify, dict):
+        if stratify or common or distinct:
+            raise InputError(f"❌ Manifest entry {i}: stratify, common and distinct need a sample_size")
+        return None
+    return Sampling(size, stratify=stratify, common=common, distinct=distinct)
+
+def load_manifest(path, default_versions):
+    # A JSON list of banks (or {"banks": [...]}). Each entry names either a
+    # questions/answers pair or a compiled "bank", plus optional "name",
+    # "versions", "seed" and sampling fields as on the web form. Relative
+    # paths are resolved against the manifest's directory.
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    entries = data['banks'] if isinstance(data, dict) else data
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    names = set()
+    for i, entry in enumerate(entries, 1):
+        if 'bank' in entry:
+            # A stored bank id is looked up in BANKS_DIR by open_bank().
+            source = entry['bank']
+            if not re.fullmatch(r'[0-9a-f]{64}', source):
+                source = os.path.join(base, source)
+        elif 'questions' in entry and 'answers' in entry:
+            source = (os.path.join(base, entry['questions']), os.path.join(base, entry['answers']))
+        else:
+            raise InputError(f"❌ Manifest entry {i} needs 'bank' or 'questions' and 'answers'")
+        first = source if isinstance(source, str) else source[0]
+        name = entry.get('name') or os.path.splitext(os.path.basename(first))[0]
+        if name in names:
+            raise InputError(f"❌ Manifest entry {i} reuses the name {name!r}")
+        names.add(name)
+        jobs.append({
+            'name': name,
+            'source': source,
+            'versions': manifest_int(entry, 'versions', i, default_versions, minimum=1),
+            'seed': manifest_int(entry, 'seed', i),
+            'sampling': manifest_sampling(entry, i),
+        })
+    return jobs
+
+def input_hash(source):
+    if isinstance(source, str):
+        return open_bank(source).content_hash()
+    with open(source[0], 'rb') as q_file, open(source[1], 'rb') as a_file:
+        return upload_key(q_file, a_file)
+
+def output_stamp(job, layout, level):
+    # Everything the output depends on. An unseeded entry is not pinned to
+    # a seed, so any earlier output for the same inputs counts as current.
+    return hashlib.sha256(json.dumps([
+        input_hash(job['source']), job['versions'], job['seed'],
+        repr(tuple(job['sampling'])) if job['sampling'] else None, layout, level, BANK_VERSION,
+    ]).encode('utf-8')).hexdigest()
+
+def read_stamp(path):
+    with contextlib.suppress(FileNotFoundError, ValueError):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def write_versions(versions, target, layout, level=ARCHIVE_LEVEL):
+    # Versions go straight to disk as they are rendered; a zip is written
+    # under a temporary name and only moved into place once complete.
+    if layout == 'zip':
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in stream_zip(versions, level):
+                    f.write(chunk)
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, target)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+        return
+    os.makedirs(target, exist_ok=True)
+    for files in versions:
+        for name, content in files.items():
+            with open(os.path.join(target, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+
+def run_batch_job(job, out_dir, layout, level, force):
+    # Runs in a worker process; returns (name, outcome, detail).
+    target = os.path.join(out_dir, job['name'] + ('.zip' if layout == 'zip' else ''))
+    stamp_path = os.path.join(out_dir, f".{job['name']}.stamp")
+    try:
+        stamp = output_stamp(job, layout, level)
+        previous = read_stamp(stamp_path)
+        if not force and previous.get('stamp') == stamp and os.path.exists(target):
+            return job['name'], 'skipped', f"seed {previous.get('seed')}"
+        source = job['source']
+        if isinstance(source, str):
+            bank = open_bank(source)
+        else:
+            with open(source[0], 'rb') as q_file, open(source[1], 'rb') as a_file:
+                bank, rejected = build_bank(q_file, a_file)
+            for name, lineno, reason in rejected:
+                print(f"⚠️  {job['name']}: {name} line {lineno}: {reason}", file=sys.stderr)
+        seed = job['seed'] if job['seed'] is not None else new_seed()
+        versions = iter_versions(bank, job['versions'], seed, workers=1, sampling=job['sampling'])
+        write_versions(versions, target, layout, level)
+        with open(stamp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stamp': stamp, 'seed': seed}, f)
+        return job['name'], 'written', f"seed {seed}"
+    except (InputError, OSError) as e:
+        return job['name'], 'failed', str(e)
+    except Exception as e:
+        # Anything else is still one bank's failure, not the whole batch's.
+        return job['name'], 'failed', f"{type(e).__name__}: {e}"
+
+def batch_command(args):
+    jobs = load_manifest(args.manifest, args.versions)
+    os.makedirs(args.output, exist_ok=True)
+    failed = 0
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = {
+            pool.submit(run_batch_job, job, args.output, args.layout, args.compression, args.force): job['name']
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                name, outcome, detail = future.result()
+            except Exception as e:
+                # e.g. a worker process that died; the other banks still report.
+                name, outcome, detail = futures[future], 'failed', f"{type(e).__name__}: {e}"
+            icon = {'written': '✅', 'skipped': '⏭️ ', 'failed': '❌'}[outcome]
+            print(f"{icon} {name}: {outcome} ({detail})")
+            failed += outcome == 'failed'
+    if failed:
+        sys.exit(f"❌ {failed} of {len(jobs)} banks failed")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exam Paper Generator command-line tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = commands.add_parser('compile', help="compile a questions/answers pair into a .qbank file")
+    compile_parser.add_argument('questions', help="questions.txt")
+    compile_parser.add_argument('answers', help="answers.txt")
+    compile_parser.add_argument('-o', '--output', help=f"output path (default: {BANKS_DIR}/<id>.qbank)")
+    compile_parser.set_defaults(func=compile_command)
+
+    batch_parser = commands.add_parser('batch', help="generate exams for every bank in a manifest")
+    batch_parser.add_argument('manifest', help="JSON manifest of banks")
+    batch_parser.add_argument('output', help="directory to write archives into")
+    batch_parser.add_argument('--versions', type=int, default=2, help="versions for entries that do not set one")
+    batch_parser.add_argument('--layout', choices=('zip', 'files'), default='zip',
+                              help="one archive per bank, or a directory of text files per bank")
+    batch_parser.add_argument('--compression', type=int, choices=range(10), default=ARCHIVE_LEVEL, metavar='0-9',
+                              help="zlib level for zip archives; 0 stores entries uncompressed")
+    batch_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="banks generated in parallel")
+    batch_parser.add_argument('--force', action='store_true', help="regenerate banks whose outputs are up to date")
+    batch_parser.set_defaults(func=batch_command)
+
+    args = parser.parse_args(argv)
+    try:
+        args.func(args)
+    except InputError as e:
+        sys.exit(str(e))
+
+if __name__ == '__main__':
+    main()
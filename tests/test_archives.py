@@ -0,0 +1,89 @@
+import io
+import os
+import tarfile
+import zipfile
+import zlib
+
+import pytest
+
+import app
+from app import (
+    MappedBank, ZipWriter, build_bank, generate_all, iter_versions, pack_bank, stream_tar, stream_zip, unpack_bank,
+    write_bank
+)
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'samples')
+
+@pytest.fixture(scope='module')
+def bank():
+    with open(os.path.join(SAMPLES, 'questions.txt'), 'rb') as q, open(os.path.join(SAMPLES, 'answers.txt'), 'rb') as a:
+        return build_bank(q, a)[0]
+
+def zip_bytes(bank, level, versions=5, seed=7):
+    return b''.join(stream_zip(iter_versions(bank, versions, seed, workers=1), level))
+
+@pytest.mark.parametrize('level', [0, 6, 9])
+def test_zip_reads_back(bank, level):
+    archive = zipfile.ZipFile(io.BytesIO(zip_bytes(bank, level)))
+    assert archive.testzip() is None
+    expected = generate_all(bank, 5, seed=7, workers=1)
+    assert archive.namelist() == list(expected)
+    assert {name: archive.read(name).decode('utf-8') for name in archive.namelist()} == expected
+    method = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+    assert all(info.compress_type == method for info in archive.infolist())
+
+@pytest.mark.parametrize('stream', [stream_zip, stream_tar])
+def test_same_bytes_for_any_thread_count(bank, stream, monkeypatch):
+    outputs = []
+    for threads in (1, 4):
+        monkeypatch.setattr(app, 'ARCHIVE_THREADS', threads)
+        outputs.append(b''.join(stream(iter_versions(bank, 8, 3, workers=1), 6)))
+    assert outputs[0] == outputs[1]
+    assert outputs[0] == b''.join(stream(iter_versions(bank, 8, 3, workers=1), 6))
+
+def test_zip64_entry_count():
+    writer = ZipWriter()
+    parts = [writer.add(f'{i}.txt', 1, zlib.crc32(b'x'), b'x', zipfile.ZIP_STORED) for i in range(0x10000)]
+    data = b''.join(parts) + writer.finish()
+    assert b'PK\x06\x06' in data
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert len(archive.infolist()) == 0x10000
+    assert archive.read('65535.txt') == b'x'
+
+def test_zip64_offsets():
+    # Pretend 4 GiB precede the entries; zipfile maps the recorded offsets
+    # back onto the real bytes, so they must survive the ZIP64 extras.
+    writer = ZipWriter()
+    writer.offset = 2**32 + 5
+    data = writer.add('a.txt', 5, zlib.crc32(b'hello'), b'hello', zipfile.ZIP_STORED)
+    data += writer.add('b.txt', 3, zlib.crc32(b'bye'), b'bye', zipfile.ZIP_STORED)
+    data += writer.finish()
+    assert b'PK\x06\x06' in data
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    assert archive.read('a.txt') == b'hello'
+    assert archive.read('b.txt') == b'bye'
+
+@pytest.mark.parametrize('level, mode', [(6, 'r:gz'), (0, 'r:')])
+def test_tar_reads_back(bank, level, mode):
+    data = b''.join(stream_tar(iter_versions(bank, 4, 11, workers=1), level))
+    with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as archive:
+        members = archive.getmembers()
+        files = {m.name: archive.extractfile(m).read().decode('utf-8') for m in members}
+    assert files == generate_all(bank, 4, seed=11, workers=1)
+    assert {m.mtime for m in members} == {app.ARCHIVE_MTIME}
+
+def test_compiled_bank_round_trip(bank, tmp_path):
+    path = tmp_path / 'bank.qbank'
+    write_bank(bank, path)
+    mapped = MappedBank(path)
+    assert len(mapped) == len(bank)
+    assert mapped.content_hash() == bank.content_hash()
+    assert mapped.topic_names == bank.topic_names
+    assert generate_all(mapped, 6, seed=5, workers=1) == generate_all(bank, 6, seed=5, workers=1)
+
+def test_packed_bank_round_trip(bank):
+    unpacked = unpack_bank(pack_bank(bank))
+    assert unpacked.content_hash() == bank.content_hash()
+    assert unpacked.stems.tolist() == bank.stems.tolist()
+    assert generate_all(unpacked, 3, seed=2, workers=1) == generate_all(bank, 3, seed=2, workers=1)
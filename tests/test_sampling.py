@@ -0,0 +1,82 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from app import (
+    InputError, Sampling, allocate, generate_all, label_index, parse_answers, parse_questions, pick, render_single,
+    run_entropy, sample_versions, version_label
+)
+
+def topic_bank(per_topic=10, topics=7):
+    # Question i is in topic i % topics, so every topic has `per_topic` rows.
+    questions, answers = [], []
+    for i in range(1, per_topic * topics + 1):
+        questions += [f"Q{i} [Topic {i % topics}]: Question number {i}?",
+                      *(f"{letter}) Choice {letter} of {i}" for letter in 'ABCD'), '']
+        answers.append(f"Q{i}: {'ABCD'[i % 4]}")
+    bank = parse_questions('\n'.join(questions).encode('utf-8'))
+    bank.correct = parse_answers('\n'.join(answers).encode('utf-8'))
+    return bank
+
+@pytest.fixture(scope='module')
+def bank():
+    return topic_bank()
+
+def samples(bank, sampling, num=6, seed=3, first=0):
+    return [r.tolist() for r in sample_versions(bank, num, sampling, run_entropy(bank, seed), first)]
+
+def test_allocate_largest_remainder():
+    assert allocate(40, [10] * 7).tolist() == [6, 6, 6, 6, 6, 5, 5]
+    assert allocate(7, [3, 1]).tolist() == [5, 2]
+    assert allocate(0, [2, 5]).tolist() == [0, 0]
+
+@pytest.mark.parametrize('count', [3, 900])
+def test_pick(count):
+    # 3 of 1000 takes the rejection path, 900 the dense shuffle.
+    pool = np.arange(1000, 2000)
+    exclude = frozenset(range(1000, 1050))
+    rows = pick(np.random.default_rng(0), pool, count, exclude).tolist()
+    assert len(rows) == len(set(rows)) == count
+    assert set(rows) <= set(pool.tolist()) - exclude
+
+def test_stratified_counts(bank):
+    topic_of = {row: t for t, rows in enumerate(bank.topic_rows()) for row in rows.tolist()}
+    for rows in samples(bank, Sampling(40, stratify=True)):
+        counts = Counter(topic_of[row] for row in rows)
+        assert sorted(counts.values(), reverse=True) == [6, 6, 6, 6, 6, 5, 5]
+
+@pytest.mark.parametrize('common', [0, 4])
+def test_distinct_overlap(bank, common):
+    versions = [set(rows) for rows in samples(bank, Sampling(30, common=common, distinct=True), num=8)]
+    anchors = set.intersection(*versions)
+    assert len(anchors) == common
+    for before, after in zip(versions, versions[1:]):
+        assert before & after == anchors
+    assert all(len(rows) == 30 for rows in versions)
+
+def test_too_small_bank(bank):
+    with pytest.raises(InputError):
+        samples(bank, Sampling(40, distinct=True))
+    with pytest.raises(InputError):
+        samples(bank, Sampling(len(bank) + 1))
+    with pytest.raises(InputError):
+        samples(bank, Sampling(10, common=11))
+
+@pytest.mark.parametrize('sampling', [Sampling(20), Sampling(30, stratify=True, common=3, distinct=True)])
+def test_replay_from_first(bank, sampling):
+    everything = samples(bank, sampling, num=7)
+    assert samples(bank, sampling, num=7, first=4) == everything[4:]
+
+@pytest.mark.parametrize('sampling', [None, Sampling(25, stratify=True, common=2, distinct=True)])
+def test_render_single_matches_run(bank, sampling):
+    run = generate_all(bank, 5, seed=9, workers=1, sampling=sampling)
+    for index in (0, 3, 4):
+        single = render_single(bank, 9, index, sampling)
+        assert single == {name: run[name] for name in single}
+
+def test_version_labels():
+    assert [version_label(i) for i in (0, 25, 26, 27, 701, 702)] == ['A', 'Z', 'AA', 'AB', 'ZZ', 'AAA']
+    assert all(label_index(version_label(i)) == i for i in range(2000))
+    assert label_index('a') is None
+    assert label_index('A1') is None